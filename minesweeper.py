@@ -1,7 +1,25 @@
+import collections
 import itertools
 import random
 
 
+def _neighbour_table(height, width):
+    """
+    Maps each cell on a height x width board to a tuple of the
+    in-bounds cells within one row and column of it.
+    """
+    table = {}
+    for i in range(height):
+        for j in range(width):
+            table[(i, j)] = tuple(
+                (row, column)
+                for row in range(max(0, i - 1), min(height, i + 2))
+                for column in range(max(0, j - 1), min(width, j + 2))
+                if (row, column) != (i, j)
+            )
+    return table
+
+
 class Minesweeper:
     """
     Minesweeper game representation
@@ -15,20 +33,14 @@ class Minesweeper:
         self.mines = set()
 
         # Initialize an empty field with no mines
-        self.board = []
-        for i in range(self.height):
-            row = []
-            for j in range(self.width):
-                row.append(False)
-            self.board.append(row)
-
-        # Add mines randomly
-        while len(self.mines) != mines:
-            i = random.randrange(height)
-            j = random.randrange(width)
-            if not self.board[i][j]:
-                self.mines.add((i, j))
-                self.board[i][j] = True
+        self.board = [[False] * self.width for _ in range(self.height)]
+        self._neighbours = _neighbour_table(height, width)
+
+        # Add mines randomly, drawing distinct cells in one go
+        for index in random.sample(range(height * width), mines):
+            i, j = divmod(index, width)
+            self.mines.add((i, j))
+            self.board[i][j] = True
 
         # At first, player has found no mines
         self.mines_found = set()
@@ -38,10 +50,10 @@ class Minesweeper:
         Prints a text-based representation
         of where mines are located.
         """
-        for i in range(self.height):
+        for row in self.board:
             print("--" * self.width + "-")
-            for j in range(self.width):
-                if self.board[i][j]:
+            for is_mine in row:
+                if is_mine:
                     print("|X", end="")
                 else:
                     print("| ", end="")
@@ -58,24 +70,7 @@ class Minesweeper:
         within one row and column of a given cell,
         not including the cell itself.
         """
-
-        # Keep count of nearby mines
-        count = 0
-
-        # Loop over all cells within one row and column
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-
-                # Ignore the cell itself
-                if (i, j) == cell:
-                    continue
-
-                # Update count if cell in bounds and is mine
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    if self.board[i][j]:
-                        count += 1
-
-        return count
+        return sum(self.board[i][j] for i, j in self._neighbours[cell])
 
     def won(self):
         """
@@ -87,62 +82,93 @@ class Minesweeper:
 class Sentence:
     """
     Logical statement about a Minesweeper game
-    A sentence consists of a set of board cells,
+    A sentence consists of a bitmask of board cells,
     and a count of the number of those cells which are mines.
+    Cell (i, j) is bit i * width + j of the mask.
+
+    Sentences compare and hash by value. Marking cells changes that value,
+    so the AI tracks them in sets by key() rather than by the sentence.
     """
 
     def __init__(self, cells, count):
-        self.cells = set(cells)
+        self.cells = cells
         self.count = count
-        self.mine_cell = set()
-        self.safe_cell = set()
+        # set while the sentence is waiting to be rechecked
+        self.dirty = True
+        # cleared once every cell is known and the sentence can be dropped
+        self.alive = True
 
     def __eq__(self, other):
-        return self.cells == other.cells and self.count == other.count
+        if not isinstance(other, Sentence):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
 
     def __str__(self):
-        return f"{self.cells} = {self.count}"
+        return f"{self.cells:b} = {self.count}"
+
+    def key(self):
+        """
+        Returns the (cells, count) pair identifying this sentence.
+        """
+        return (self.cells, self.count)
 
     def known_mines(self):
         """
-        Returns the set of all cells in self.cells known to be mines.
+        Returns the mask of all cells in self.cells known to be mines.
         """
-        # if count = number of cells being searched, return the set
-        # return empty set if none found to be consitant
+        # if count = number of cells being searched, return the mask
+        # return empty mask if none found to be consitant
         # otherwise currently unsure
-        if self.count == len(self.cells):
+        if self.count == self.cells.bit_count():
             return self.cells
         else:
-            return set()
+            return 0
 
     def known_safes(self):
         """
-        Returns the set of all cells in self.cells known to be safe.
+        Returns the mask of all cells in self.cells known to be safe.
         """
         if self.count == 0:
             return self.cells
         else:
-            return set()
+            return 0
 
-    def mark_mine(self, cell):
+    def mark_mine(self, bit):
         """
         Updates internal knowledge representation given the fact that
-        a cell is known to be a mine.
+        the cell with the given bit is known to be a mine.
         """
-        # check it is in the list, remove it and reduce count
-        if cell in self.cells:
-            self.cells.remove(cell)
+        # check it is in the mask, remove it and reduce count
+        if self.cells & bit:
+            self.cells &= ~bit
             self.count -= 1
-            self.mine_cell.add(cell)
+            self.dirty = True
+            self.alive = bool(self.cells)
 
-    def mark_safe(self, cell):
+    def mark_safe(self, bit):
         """
         Updates internal knowledge representation given the fact that
-        a cell is known to be safe.
+        the cell with the given bit is known to be safe.
         """
-        if cell in self.cells:
-            self.cells.remove(cell)
-            self.safe_cell.add(cell)
+        if self.cells & bit:
+            self.cells &= ~bit
+            self.dirty = True
+            self.alive = bool(self.cells)
+
+    def mark_mines_and_safes(self, mines, safes):
+        """
+        Updates internal knowledge representation given masks of cells
+        known to be mines and known to be safe, in one step.
+        """
+        known = self.cells & (mines | safes)
+        if known:
+            self.count -= (known & mines).bit_count()
+            self.cells &= ~known
+            self.dirty = True
+            self.alive = bool(self.cells)
 
 
 class MinesweeperAI:
@@ -155,6 +181,7 @@ class MinesweeperAI:
         # Set initial height and width
         self.height = height
         self.width = width
+        self._all_cells = frozenset(itertools.product(range(height), range(width)))
 
         # Keep track of which cells have been clicked on
         self.moves_made = set()
@@ -163,26 +190,70 @@ class MinesweeperAI:
         self.mines = set()
         self.safes = set()
 
+        # The same known mines and safes as bitmasks
+        self._mine_bits = 0
+        self._safe_bits = 0
+
+        # Known safe cells that have not been clicked on yet
+        self._safe_unplayed = set()
+
+        # Bitmask of the in-bounds neighbours of each cell
+        self._neighbour_masks = {
+            cell: sum(self._bit(neighbour) for neighbour in neighbours)
+            for cell, neighbours in _neighbour_table(height, width).items()
+        }
+
         # List of sentences about the game known to be true
         self.knowledge = []
 
+        # Keys of the sentences in knowledge, for quick duplicate checks
+        self._sentence_keys = set()
+
+        # Map each cell bit to the sentences in knowledge that contain it
+        self._cell_to_sentences = {}
+
+        # Sentences added or changed since they were last checked
+        self._worklist = collections.deque()
+
     def mark_mine(self, cell):
         """
         Marks a cell as a mine, and updates all knowledge
         to mark that cell as a mine as well.
         """
-        self.mines.add(cell)
-        for sentence in self.knowledge:
-            sentence.mark_mine(cell)
+        self._mark_known(self._bit(cell), 0)
 
     def mark_safe(self, cell):
         """
         Marks a cell as safe, and updates all knowledge
         to mark that cell as safe as well.
         """
-        self.safes.add(cell)
-        for sentence in self.knowledge:
-            sentence.mark_safe(cell)
+        self._mark_known(0, self._bit(cell))
+
+    def _mark_known(self, mines, safes):
+        """
+        Marks every cell in the mines and safes bitmasks, updating
+        each sentence that holds any of them only once.
+        """
+        if mines:
+            self._mine_bits |= mines
+            self.mines.update(self._cells(mines))
+        if safes:
+            self._safe_bits |= safes
+            new_safes = list(self._cells(safes))
+            self.safes.update(new_safes)
+            self._safe_unplayed.update(
+                safe for safe in new_safes if safe not in self.moves_made
+            )
+
+        # only the sentences holding the cells change, and they lose them all
+        changed = {}
+        for bit in self._bits(mines | safes):
+            for sentence in self._cell_to_sentences.pop(bit, ()):
+                changed[id(sentence)] = sentence
+        for sentence in changed.values():
+            if not sentence.dirty:
+                self._worklist.append(sentence)
+            sentence.mark_mines_and_safes(mines, safes)
 
     def add_knowledge(self, cell, count):
         """
@@ -200,88 +271,151 @@ class MinesweeperAI:
                if they can be inferred from existing knowledge
         """
         self.moves_made.add(cell)
+        self._safe_unplayed.discard(cell)
+        # only rerun inference if this click taught us something new
+        updated = cell not in self.safes
         self.mark_safe(cell)
-        known_mines_count = 0
-        neighbours = set()
-
-        # cell is (row, column)
-        # loop through each neighbour cell
-        # unsure how to handle negative index?
-        # row -1 is left and 0 is current and +1 is right
-        for row in range(cell[0] - 1, cell[0] + 2):
-            for collumn in range(cell[1] - 1, cell[1] + 2):
-                # if it is the working cell, skip
-                if (row, collumn) == cell:
-                    continue
-                # check we wont go out of range
-                if 0 <= row < self.height and 0 <= collumn < self.width:
-                    # if it is a mine, add to a counter
-                    if (row, collumn) in self.mines:
-                        known_mines_count += 1
-                    # if unknown add to neighbours to add later
-                    elif (row, collumn) not in self.safes:
-                        neighbours.add((row, collumn))
+
+        # count the neighbours known to be mines, and keep the unknown ones
+        neighbours = self._neighbour_masks[cell]
+        known_mines_count = (neighbours & self._mine_bits).bit_count()
+        neighbours &= ~(self._mine_bits | self._safe_bits)
         #  add to knowledge db
         adjusted_count = count - known_mines_count
 
+        # no mines or only mines left means the neighbours can be marked
+        # directly, rather than adding a sentence the next pass would clear
         if neighbours:
-            self.knowledge.append(Sentence(neighbours, adjusted_count))
+            if adjusted_count == 0:
+                self._mark_known(0, neighbours)
+            elif adjusted_count == neighbours.bit_count():
+                self._mark_known(neighbours, 0)
+            else:
+                self._add_sentence(Sentence(neighbours, adjusted_count))
+            updated = True
 
-        self.update_knowledge()
+        if updated:
+            self.update_knowledge()
 
     def update_knowledge(self):
         """
         Updates the knowledge base to mark new cells as safe or mine
         """
-        updated = True
-        while updated:
-            updated = False
-            new_mines = set()
-            new_safes = set()
-            #  Get all mines and safe squares
-            for sentence in self.knowledge:
+        # Only sentences that were added or changed since they were last
+        # looked at can give anything new away
+        while self._worklist:
+            # Settle every queued sentence that gives away mines or safes
+            # before paying for any subset inference
+            pending = {}
+            while self._worklist:
+                sentence = self._worklist.popleft()
+                sentence.dirty = False
+                if not sentence.alive:
+                    continue
+
+                #  Get all new mines and safe squares, which empties the sentence
                 mines = sentence.known_mines()
                 safes = sentence.known_safes()
-                # Add to a set to process
-                if mines:
-                    new_mines.update(mines)
-                if safes:
-                    new_safes.update(safes)
-            # update the mine set and set to updated to loop again
-            for mine in new_mines:
-                if mine not in self.mines:
-                    self.mark_mine(mine)
-                    updated = True
-            for safe in new_safes:
-                self.mark_safe(safe)
-                updated = True
-
-            # clear empty sentences
-            self.knowledge = [
-                sentence_ for sentence_ in self.knowledge if sentence_.cells
-            ]
-
-            # Generate new sentences by combining
-            new_sentences = []
-            for sentence_1 in self.knowledge:
-                for sentence_2 in self.knowledge:
+                if mines or safes:
+                    self._mark_known(mines & ~self._mine_bits, safes & ~self._safe_bits)
+                else:
+                    pending[id(sentence)] = sentence
+
+            # Generate new sentences by combining the ones left over; any
+            # that are added are settled on the next time round
+            for sentence in pending.values():
+                if not sentence.alive:
+                    continue
+                self._sentence_keys.add(sentence.key())
+                new_sentences = []
+                for sentence_1, sentence_2 in self._subset_pairs(sentence):
+                    new_cells = sentence_1.cells & ~sentence_2.cells
+                    new_count = sentence_1.count - sentence_2.count
+                    # if more than 1 mine, new sentence
                     if (
-                        sentence_1 != sentence_2
-                        and sentence_2.cells.issubset(sentence_1.cells)
-                        and sentence_2.cells
+                        new_cells
+                        and new_count >= 0
+                        and (new_cells, new_count) not in self._sentence_keys
                     ):
-                        new_cells = sentence_1.cells - sentence_2.cells
-                        new_count = sentence_1.count - sentence_2.count
-                        # if more than 1 mine, new sentence
-                        if new_count >= 0:
-                            inferred_sentence = Sentence(new_cells, new_count)
-                            if (
-                                inferred_sentence not in self.knowledge
-                                and inferred_sentence not in new_sentences
-                            ):
-                                new_sentences.append(inferred_sentence)
-                                updated = True
-            self.knowledge.extend(new_sentences)
+                        self._sentence_keys.add((new_cells, new_count))
+                        new_sentences.append(Sentence(new_cells, new_count))
+                for new_sentence in new_sentences:
+                    self._add_sentence(new_sentence)
+
+        # clear empty sentences, once the whole update is done
+        self.knowledge = [
+            sentence_ for sentence_ in self.knowledge if sentence_.alive
+        ]
+        self._sentence_keys = {sentence_.key() for sentence_ in self.knowledge}
+
+    def _subset_pairs(self, sentence):
+        """
+        Returns (superset, subset) pairs of sentences in knowledge
+        where one side is the given sentence.
+        """
+        pairs = []
+        bits = list(self._bits(sentence.cells))
+        size = len(bits)
+
+        # any superset of sentence contains every one of its cells,
+        # so only the sentences sharing its rarest cell can qualify
+        rarest = min(bits, key=lambda bit: len(self._cell_to_sentences[bit]))
+        for sentence_1 in self._cell_to_sentences[rarest]:
+            # identity and size are cheap, so test them before the masks
+            if (
+                sentence_1 is not sentence
+                and sentence_1.cells.bit_count() > size
+                and sentence_1.cells & sentence.cells == sentence.cells
+            ):
+                pairs.append((sentence_1, sentence))
+
+        # any subset of sentence shares at least one of its cells
+        checked = set()
+        for bit in bits:
+            for sentence_2 in self._cell_to_sentences[bit]:
+                if id(sentence_2) in checked:
+                    continue
+                checked.add(id(sentence_2))
+                if (
+                    sentence_2 is not sentence
+                    and sentence_2.cells.bit_count() < size
+                    and sentence.cells & sentence_2.cells == sentence_2.cells
+                ):
+                    pairs.append((sentence, sentence_2))
+        return pairs
+
+    def _add_sentence(self, sentence):
+        """
+        Adds a sentence to knowledge and queues it to be checked.
+        """
+        self.knowledge.append(sentence)
+        self._sentence_keys.add(sentence.key())
+        for bit in self._bits(sentence.cells):
+            self._cell_to_sentences.setdefault(bit, []).append(sentence)
+        self._worklist.append(sentence)
+
+    def _bit(self, cell):
+        """
+        Returns the bitmask with only the given cell set.
+        """
+        return 1 << (cell[0] * self.width + cell[1])
+
+    def _bits(self, mask):
+        """
+        Yields the single-bit mask of each cell set in mask.
+        """
+        while mask:
+            # peel off the lowest set bit
+            bit = mask & -mask
+            yield bit
+            mask ^= bit
+
+    def _cells(self, mask):
+        """
+        Yields the (row, column) of each cell set in mask.
+        """
+        for bit in self._bits(mask):
+            yield divmod(bit.bit_length() - 1, self.width)
 
     def make_safe_move(self):
         """
@@ -292,10 +426,7 @@ class MinesweeperAI:
         This function may use the knowledge in self.mines, self.safes
         and self.moves_made, but should not modify any of those values.
         """
-        for move in self.safes:
-            if move not in self.moves_made:
-                return move
-        return None
+        return next(iter(self._safe_unplayed), None)
 
     def make_random_move(self):
         """
@@ -304,18 +435,18 @@ class MinesweeperAI:
             1) have not already been chosen, and
             2) are not known to be mines
         """
-        #  wont work as can't break if all moves are done
-        # move = (
-        #     random.randint(0, self.height +1),
-        #     random.randint(0, self.width +1)
-        #     )
-        # while move in self.moves_made:
-        #     move = (
-        #         random.randint(0, self.height +1),
-        #         random.randint(0, self.width +1)
-        #         )
-        all_cells = set(itertools.product(range(self.height), range(self.width)))
-        possible_moves = list(all_cells - self.moves_made - self.mines)
+        # moves and mines never overlap, as clicking a mine ends the game
+        taken = len(self.moves_made) + len(self.mines)
+
+        # while most of the board is free, guessing cells until one is
+        # allowed is quicker than listing every remaining cell
+        if taken < 0.8 * self.height * self.width:
+            while True:
+                move = (random.randrange(self.height), random.randrange(self.width))
+                if move not in self.moves_made and move not in self.mines:
+                    return move
+
+        possible_moves = list(self._all_cells - self.moves_made - self.mines)
         if possible_moves:
             return random.choice(possible_moves)
         else: